@@ -78,6 +78,159 @@ class SmoothTest(g.unittest.TestCase):
         assert g.np.isclose(b.volume, m.volume, rtol=0.1)
         assert g.np.isclose(v.volume, m.volume, rtol=0.1)
 
+    def test_laplacian_cache(self):
+        m = g.trimesh.creation.icosphere()
+
+        lap = g.trimesh.smoothing.laplacian_calculation(m)
+        again = g.trimesh.smoothing.laplacian_calculation(m)
+        # repeated calls return equal copies of the cached operator
+        assert again is not lap
+        assert (again != lap).nnz == 0
+        # editing a returned copy should not alter the cache
+        again.data[:] = 0.0
+        assert (g.trimesh.smoothing.laplacian_calculation(m) != lap).nnz == 0
+
+        # different weighting is a different operator
+        umbrella = g.trimesh.smoothing.laplacian_calculation(
+            m, equal_weight=False)
+        assert (umbrella != lap).nnz > 0
+        # pins are compared by value rather than by order
+        pinned = g.trimesh.smoothing.laplacian_calculation(
+            m, pinned_vertices=[3, 1])
+        assert (pinned != lap).nnz > 0
+        assert (pinned != g.trimesh.smoothing.laplacian_calculation(
+            m, pinned_vertices=[1, 3, 3])).nnz == 0
+
+        # smoothing only moves vertices so a chained filter should
+        # reuse the operator without querying the vertex neighbors
+        g.trimesh.smoothing.filter_taubin(m)
+        assert 'vertex_neighbors' not in m._cache
+        g.trimesh.smoothing.filter_laplacian(m)
+        assert 'vertex_neighbors' not in m._cache
+        assert (g.trimesh.smoothing.laplacian_calculation(m) != lap).nnz == 0
+
+        # changing the faces should build a new operator
+        m.faces = m.faces[:, ::-1]
+        g.trimesh.smoothing.laplacian_calculation(m)
+        assert 'vertex_neighbors' in m._cache
+
+    def test_reorder(self):
+        m = g.trimesh.creation.icosphere(subdivisions=3)
+        # shuffle the vertices so the ordering actually changes
+        perm = g.np.random.permutation(len(m.vertices))
+        inverse = g.np.argsort(perm)
+        m = g.trimesh.Trimesh(m.vertices[perm], inverse[m.faces])
+        lap = g.trimesh.smoothing.laplacian_calculation(m)
+
+        for name in ['filter_laplacian',
+                     'filter_humphrey',
+                     'filter_taubin']:
+            function = getattr(g.trimesh.smoothing, name)
+            a = function(m.copy(), laplacian_operator=lap)
+            b = function(m.copy(), laplacian_operator=lap, reorder=True)
+            # reordering should only change the memory layout
+            assert g.np.allclose(a.vertices, b.vertices)
+
+    def test_dtype(self):
+        m = g.trimesh.creation.icosphere(subdivisions=3)
+        lap = g.trimesh.smoothing.laplacian_calculation(m)
+
+        for name in ['filter_laplacian',
+                     'filter_humphrey',
+                     'filter_taubin',
+                     'filter_mut_dif_laplacian']:
+            function = getattr(g.trimesh.smoothing, name)
+            a = function(m.copy(), laplacian_operator=lap)
+            b = function(m.copy(),
+                         laplacian_operator=lap,
+                         dtype=g.np.float32)
+            # single precision should give nearly the same result
+            assert g.np.allclose(a.vertices, b.vertices, atol=1e-3)
+            assert g.np.isclose(a.volume, b.volume, rtol=1e-3)
+
+    def test_threads(self):
+        m = g.trimesh.creation.icosphere(subdivisions=3)
+        lap = g.trimesh.smoothing.laplacian_calculation(m)
+
+        # small operators should run serially even if asked not to
+        with g.trimesh.smoothing._split_rows(3, lap) as split:
+            assert split(lap) is lap
+
+        smoothing = g.trimesh.smoothing
+        limits = smoothing._threads_min_nnz, smoothing._threads_min_rows
+        # drop the size floor so the threaded path actually runs
+        smoothing._threads_min_nnz, smoothing._threads_min_rows = 0, 0
+        try:
+            for name in ['filter_laplacian',
+                         'filter_humphrey',
+                         'filter_taubin',
+                         'filter_mut_dif_laplacian']:
+                function = getattr(smoothing, name)
+                before = g.threading.active_count()
+                a = function(m.copy(), laplacian_operator=lap, threads=1)
+                b = function(m.copy(), laplacian_operator=lap, threads=3)
+                # every row is summed the same way on any thread
+                assert g.np.allclose(a.vertices, b.vertices)
+                # worker threads should not outlive the call
+                assert g.threading.active_count() == before
+        finally:
+            smoothing._threads_min_nnz, smoothing._threads_min_rows = limits
+
+    def test_pinned(self):
+        m = g.trimesh.creation.icosphere(subdivisions=3)
+        neighbors = [list(n) for n in m.vertex_neighbors]
+        pinned = [0, 10, 20]
+
+        lap = g.trimesh.smoothing.laplacian_calculation(
+            m, pinned_vertices=pinned)
+        # the cached neighbors should not have been modified
+        assert neighbors == [list(n) for n in m.vertex_neighbors]
+        # pinned rows should only contain themselves
+        assert g.np.allclose(lap[pinned].toarray(),
+                             g.np.eye(len(m.vertices))[pinned])
+
+        s = g.trimesh.smoothing.filter_humphrey(
+            m.copy(), laplacian_operator=lap)
+        # pinned vertices should not have moved
+        assert g.np.allclose(s.vertices[pinned], m.vertices[pinned])
+
+    def test_unreferenced(self):
+        m = g.trimesh.creation.icosphere()
+        # add a vertex which no face references
+        m = g.trimesh.Trimesh(
+            g.np.vstack((m.vertices, [[5.0, 5.0, 5.0]])),
+            m.faces,
+            process=False)
+
+        with g.warnings.catch_warnings():
+            g.warnings.simplefilter('error', RuntimeWarning)
+            lap = g.trimesh.smoothing.laplacian_calculation(m)
+        # the isolated vertex should have an empty row
+        assert lap.shape == (len(m.vertices),) * 2
+        assert lap[-1].nnz == 0
+
+    def test_vertices_normals(self):
+        m = g.trimesh.creation.icosphere()
+        incidence = g.trimesh.geometry.index_sparse(
+            len(m.vertices), m.faces).tocsr()
+
+        normals = g.trimesh.smoothing.get_vertices_normals(m)
+        # a precomputed incidence should give the same normals
+        assert g.np.allclose(
+            normals,
+            g.trimesh.smoothing.get_vertices_normals(
+                m, incidence_csr=incidence))
+        # normals of passed positions should match a moved mesh
+        moved = m.vertices * [1.0, 2.0, 0.5]
+        assert g.np.allclose(
+            g.trimesh.smoothing.get_vertices_normals(
+                g.trimesh.Trimesh(moved, m.faces, process=False)),
+            g.trimesh.smoothing.get_vertices_normals(
+                m, incidence_csr=incidence, vertices=moved))
+        # vertices of a sphere roughly point along their normals
+        assert g.np.allclose(
+            normals, g.trimesh.util.unitize(m.vertices), atol=0.05)
+
 
 if __name__ == '__main__':
     g.trimesh.util.attach_to_log()
@@ -1,15 +1,23 @@
 from datasci_tools import numpy_dep as np
 
+from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
+
 try:
-    from scipy.sparse.linalg import spsolve
+    from scipy.sparse.linalg import splu
     from scipy.sparse import coo_matrix, eye
+    from scipy.sparse.csgraph import reverse_cuthill_mckee
 except ImportError:
     pass
 
-from . import triangles
 from .util import unitize
 from .geometry import index_sparse
-from .triangles import mass_properties
+
+# below either size starting threads costs more than splitting
+# the sparse dot product saves, so operators run serially even
+# when a number of threads is passed
+_threads_min_nnz = 200000
+_threads_min_rows = 10000
 
 
 def filter_laplacian(mesh,
@@ -17,7 +25,10 @@ def filter_laplacian(mesh,
                      iterations=10,
                      implicit_time_integration=False,
                      volume_constraint=True,
-                     laplacian_operator=None):
+                     laplacian_operator=None,
+                     reorder=False,
+                     dtype=None,
+                     threads=None):
     """
     Smooth a mesh in-place using laplacian smoothing.
     Articles
@@ -41,49 +52,69 @@ def filter_laplacian(mesh,
         -lamb no limit (Article 2)
     iterations : int
     Number of passes to run filter
-    laplacian_operator : None or scipy.sparse.coo.coo_matrix
+    laplacian_operator : None or scipy.sparse.csr_matrix
     Sparse matrix laplacian operator
     Will be autogenerated if None
+    reorder : bool
+    If True renumber vertices with reverse Cuthill-McKee
+    while smoothing so neighbors are close in memory, which
+    pays off on large meshes run for many iterations
+    dtype : None or numpy.dtype
+    Precision to smooth in, float32 halves the memory
+    traffic of the sparse dot products
+    If None the dtype of the mesh vertices is used
+    threads : None or int
+    Number of threads to run each sparse dot product on
+    If None the dot products run serially, as they do
+    for small meshes whatever is passed
     """
 
-    # if the laplacian operator was not passed create it here
-    if laplacian_operator is None:
-        laplacian_operator = laplacian_calculation(mesh)
-
     # save initial volume
     if volume_constraint:
         vol_ini = mesh.volume
 
-    # get mesh vertices and faces as vanilla numpy array
-    vertices = mesh.vertices.copy().view(np.ndarray)
-    faces = mesh.faces.copy().view(np.ndarray)
-
-    # Set matrix for linear system of equations
-    if implicit_time_integration:
-        dlap = laplacian_operator.shape[0]
-        AA = eye(dlap) + lamb * (eye(dlap) - laplacian_operator)
-
-    # Number of passes
-    for _index in range(iterations):
-        # Classic Explicit Time Integration - Article 1
-        if not implicit_time_integration:
-            dot = laplacian_operator.dot(vertices) - vertices
-            vertices += lamb * dot
-
-        # Implicit Time Integration - Article 2
+    laplacian_operator, vertices, faces, inverse = _prepare(
+        mesh, laplacian_operator, reorder, dtype)
+
+    # worker threads only live for this call, the implicit
+    # branch has no sparse dot products to run on them
+    with _split_rows(1 if implicit_time_integration else threads,
+                     laplacian_operator) as split:
+        # Set matrix for linear system of equations
+        identity = eye(laplacian_operator.shape[0], dtype=vertices.dtype)
+        if implicit_time_integration:
+            AA = identity + lamb * (identity - laplacian_operator)
+            # the system matrix is constant so factor it only once
+            lu = splu(AA.tocsc())
+            # SuperLU solves each coordinate as a contiguous column
+            # and returns column-major arrays, so keep that layout
+            vertices = np.asfortranarray(vertices)
         else:
-            vertices = spsolve(AA, vertices)
-
-        # volume constraint
-        if volume_constraint:
-            # find the volume with new vertex positions
-            vol_new = triangles.mass_properties(
-                vertices[faces], skip_inertia=True)["volume"]
-            # scale by volume ratio
-            vertices *= ((vol_ini / vol_new) ** (1.0 / 3.0))
+            # fold `vertices += lamb * (L.dot(vertices) - vertices)`
+            # into one operator so each pass is a single sparse dot
+            step = split(((1.0 - lamb) * identity +
+                          lamb * laplacian_operator).tocsr())
+
+        # Number of passes
+        for _index in range(iterations):
+            # Classic Explicit Time Integration - Article 1
+            if not implicit_time_integration:
+                vertices = step.dot(vertices)
+
+            # Implicit Time Integration - Article 2
+            else:
+                vertices = lu.solve(vertices)
+
+            # volume constraint
+            if volume_constraint:
+                # find the volume with new vertex positions
+                vol_new = _mesh_volume(vertices, faces)
+                # scale by volume ratio, cbrt keeps the sign of the
+                # ratio where a fractional power would go complex
+                vertices *= np.cbrt(vol_ini / vol_new)
 
     # assign modified vertices back to mesh
-    mesh.vertices = vertices
+    _assign(mesh, vertices, inverse)
     return mesh
 
 
@@ -91,7 +122,10 @@ def filter_humphrey(mesh,
                     alpha=0.1,
                     beta=0.5,
                     iterations=10,
-                    laplacian_operator=None):
+                    laplacian_operator=None,
+                    reorder=False,
+                    dtype=None,
+                    threads=None):
     """
     Smooth a mesh in-place using laplacian smoothing
     and Humphrey filtering.
@@ -112,29 +146,52 @@ def filter_humphrey(mesh,
       If 1.0, full aggressiveness
     iterations : int
       Number of passes to run filter
-    laplacian_operator : None or scipy.sparse.coo.coo_matrix
+    laplacian_operator : None or scipy.sparse.csr_matrix
       Sparse matrix laplacian operator
       Will be autogenerated if None
+    reorder : bool
+      If True renumber vertices with reverse Cuthill-McKee
+      while smoothing so neighbors are close in memory, which
+      pays off on large meshes run for many iterations
+    dtype : None or numpy.dtype
+      Precision to smooth in, float32 halves the memory
+      traffic of the sparse dot products
+      If None the dtype of the mesh vertices is used
+    threads : None or int
+      Number of threads to run each sparse dot product on
+      If None the dot products run serially, as they do
+      for small meshes whatever is passed
     """
-    # if the laplacian operator was not passed create it here
-    if laplacian_operator is None:
-        laplacian_operator = laplacian_calculation(mesh)
-
-    # get mesh vertices as vanilla numpy array
-    vertices = mesh.vertices.copy().view(np.ndarray)
-    # save original unmodified vertices
-    original = vertices.copy()
-
-    # run through iterations of filter
-    for _index in range(iterations):
-        vert_q = vertices.copy()
-        vertices = laplacian_operator.dot(vertices)
-        vert_b = vertices - (alpha * original + (1.0 - alpha) * vert_q)
-        vertices -= (beta * vert_b + (1.0 - beta) *
-                     laplacian_operator.dot(vert_b))
+    laplacian_operator, vertices, faces, inverse = _prepare(
+        mesh, laplacian_operator, reorder, dtype)
+    # save original unmodified vertices, pre-scaled by alpha
+    # as that is the only way they are used in every pass
+    original = alpha * vertices
+
+    # worker threads only live for this call
+    with _split_rows(threads, laplacian_operator) as split:
+        # fold `beta * vert_b + (1.0 - beta) * L.dot(vert_b)`
+        # into one operator so it is a single sparse dot
+        identity = eye(laplacian_operator.shape[0], dtype=vertices.dtype)
+        blend = split((beta * identity +
+                       (1.0 - beta) * laplacian_operator).tocsr())
+        laplacian_operator = split(laplacian_operator)
+
+        # run through iterations of filter
+        for _index in range(iterations):
+            # the dot product returns a new array so the previous
+            # positions can be reused in-place instead of copied
+            vert_q = vertices
+            vertices = laplacian_operator.dot(vert_q)
+            # vert_b = vertices - (original + (1.0 - alpha) * vert_q)
+            vert_b = vert_q
+            vert_b *= alpha - 1.0
+            vert_b += vertices
+            vert_b -= original
+            vertices -= blend.dot(vert_b)
 
     # assign modified vertices back to mesh
-    mesh.vertices = vertices
+    _assign(mesh, vertices, inverse)
     return mesh
 
 
@@ -142,7 +199,10 @@ def filter_taubin(mesh,
                   lamb=0.5,
                   nu=0.5,
                   iterations=10,
-                  laplacian_operator=None):
+                  laplacian_operator=None,
+                  reorder=False,
+                  dtype=None,
+                  threads=None):
     """
     Smooth a mesh in-place using laplacian smoothing
     and taubin filtering.
@@ -160,29 +220,46 @@ def filter_taubin(mesh,
       Nu shall be between 0.0 < 1.0/lambda - 1.0/nu < 0.1
     iterations : int
       Number of passes to run the filter
-    laplacian_operator : None or scipy.sparse.coo.coo_matrix
+    laplacian_operator : None or scipy.sparse.csr_matrix
       Sparse matrix laplacian operator
       Will be autogenerated if None
+    reorder : bool
+      If True renumber vertices with reverse Cuthill-McKee
+      while smoothing so neighbors are close in memory, which
+      pays off on large meshes run for many iterations
+    dtype : None or numpy.dtype
+      Precision to smooth in, float32 halves the memory
+      traffic of the sparse dot products
+      If None the dtype of the mesh vertices is used
+    threads : None or int
+      Number of threads to run each sparse dot product on
+      If None the dot products run serially, as they do
+      for small meshes whatever is passed
     """
-    # if the laplacian operator was not passed create it here
-    if laplacian_operator is None:
-        laplacian_operator = laplacian_calculation(mesh)
-
-    # get mesh vertices as vanilla numpy array
-    vertices = mesh.vertices.copy().view(np.ndarray)
+    laplacian_operator, vertices, faces, inverse = _prepare(
+        mesh, laplacian_operator, reorder, dtype)
+
+    # worker threads only live for this call
+    with _split_rows(threads, laplacian_operator) as split:
+        # fold `vertices += lamb * (L.dot(vertices) - vertices)` and
+        # `vertices -= nu * (L.dot(vertices) - vertices)` into one
+        # operator each so every pass is a single sparse dot
+        identity = eye(laplacian_operator.shape[0], dtype=vertices.dtype)
+        shrink = split(((1.0 - lamb) * identity +
+                        lamb * laplacian_operator).tocsr())
+        dilate = split(((1.0 + nu) * identity -
+                        nu * laplacian_operator).tocsr())
+
+        # run through multiple passes of the filter
+        # alternating shrinkage and dilation in pairs
+        for _index in range(iterations // 2):
+            vertices = dilate.dot(shrink.dot(vertices))
+        # an odd number of passes ends on a shrinkage
+        if iterations % 2 == 1:
+            vertices = shrink.dot(vertices)
 
-    # run through multiple passes of the filter
-    for index in range(iterations):
-        # do a sparse dot product on the vertices
-        dot = laplacian_operator.dot(vertices) - vertices
-        # alternate shrinkage and dilation
-        if index % 2 == 0:
-            vertices += lamb * dot
-        else:
-            vertices -= nu * dot
-
-    # assign updated vertices back to mesh
-    mesh.vertices = vertices
+    # assign modified vertices back to mesh
+    _assign(mesh, vertices, inverse)
     return mesh
 
 
@@ -190,7 +267,10 @@ def filter_mut_dif_laplacian(mesh,
                              lamb=0.5,
                              iterations=10,
                              volume_constraint=True,
-                             laplacian_operator=None):
+                             laplacian_operator=None,
+                             reorder=False,
+                             dtype=None,
+                             threads=None):
     """
     Smooth a mesh in-place using laplacian smoothing using a
     mutable difusion laplacian.
@@ -212,49 +292,69 @@ def filter_mut_dif_laplacian(mesh,
       If > 0.0, diffusion occurs
     iterations : int
       Number of passes to run filter
-    laplacian_operator : None or scipy.sparse.coo.coo_matrix
+    laplacian_operator : None or scipy.sparse.csr_matrix
       Sparse matrix laplacian operator
       Will be autogenerated if None
+    reorder : bool
+      If True renumber vertices with reverse Cuthill-McKee
+      while smoothing so neighbors are close in memory, which
+      pays off on large meshes run for many iterations
+    dtype : None or numpy.dtype
+      Precision to smooth in, float32 halves the memory
+      traffic of the sparse dot products
+      If None the dtype of the mesh vertices is used
+    threads : None or int
+      Number of threads to run each sparse dot product on
+      If None the dot products run serially, as they do
+      for small meshes whatever is passed
     """
 
-    # if the laplacian operator was not passed create it here
-    if laplacian_operator is None:
-        laplacian_operator = laplacian_calculation(mesh)
-
     # Set volume constraint
     if volume_constraint:
         v_ini = mesh.volume
 
-    # get mesh vertices as vanilla numpy array
-    vertices = mesh.vertices.copy().view(np.ndarray)
-    faces = mesh.faces.copy().view(np.ndarray)
-    eps = 0.01 * (np.max(mesh.area_faces)**0.5)
-
-    # Number of passes
-    for _index in range(iterations):
-
-        # Mutable difusion
-        normals = get_vertices_normals(mesh)
-        qi = laplacian_operator.dot(vertices)
-        pi_qi = vertices - qi
-        adil = np.abs((normals * pi_qi).dot(np.ones((3, 1))))
-        adil = 1.0 / np.maximum(1e-12, adil)
-        lamber = np.maximum(
-            0.2 * lamb, np.minimum(1.0, lamb * adil / np.mean(adil)))
-
-        # Filter
-        dot = laplacian_operator.dot(vertices) - vertices
-        vertices += lamber * dot
-
-        # Volume constraint
-        if volume_constraint:
-            vol = mass_properties(vertices[faces], skip_inertia=True)["volume"]
-            if _index == 0:
-                slope = dilate_slope(vertices, faces, normals, vol, eps)
-            vertices += normals * slope * (v_ini - vol)
+    laplacian_operator, vertices, faces, inverse = _prepare(
+        mesh, laplacian_operator, reorder, dtype)
+
+    # which faces contain each vertex only depends on topology
+    incidence_csr = index_sparse(len(vertices), faces).tocsr()
+    # worker threads only live for this call
+    with _split_rows(threads, laplacian_operator) as split:
+        # `L - I` makes `L.dot(vertices) - vertices` a single sparse dot
+        identity = eye(laplacian_operator.shape[0], dtype=vertices.dtype)
+        difference = split((laplacian_operator - identity).tocsr())
+
+        # Number of passes
+        for _index in range(iterations):
+
+            # Mutable difusion
+            # vertex normals of the current vertex positions
+            normals = get_vertices_normals(mesh,
+                                           incidence_csr=incidence_csr,
+                                           vertices=vertices,
+                                           faces=faces)
+            # dot = qi - pi so only its sign differs from pi_qi
+            # which the absolute value of adil discards anyway
+            dot = difference.dot(vertices)
+            adil = np.abs((normals * dot).dot(np.ones((3, 1))))
+            adil = 1.0 / np.maximum(1e-12, adil)
+            lamber = np.maximum(
+                0.2 * lamb, np.minimum(1.0, lamb * adil / np.mean(adil)))
+
+            # Filter
+            dot *= lamber
+            vertices += dot
+
+            # Volume constraint
+            if volume_constraint:
+                vol = _mesh_volume(vertices, faces)
+                if _index == 0:
+                    slope = dilate_slope(vertices, faces, normals)
+                # multiply the scalars first to skip an (n, 3) temporary
+                vertices += normals * (slope * (v_ini - vol))
 
     # assign modified vertices back to mesh
-    mesh.vertices = vertices
+    _assign(mesh, vertices, inverse)
 
     return mesh
 
@@ -269,96 +369,384 @@ def laplacian_calculation(mesh, equal_weight=True, pinned_vertices=[]):
     equal_weight : bool
       If True, all neighbors will be considered equally
       If False, all neighbors will be weighted by inverse distance
+    pinned_vertices : (p,) int
+      Indexes of vertices which will not move
     Returns
     ----------
-    laplacian : scipy.sparse.coo.coo_matrix
+    laplacian : scipy.sparse.csr_matrix
       Laplacian operator
     """
+    # sorted unique indexes so equivalent pins share a key
+    pinned = np.unique(np.asarray(pinned_vertices, dtype=np.int64))
+    if equal_weight:
+        # equal weights only depend on the topology, which
+        # smoothing doesn't change so the filters keep this key
+        key = ('laplacian', len(mesh.vertices),
+               mesh.faces.crc(), tuple(pinned.tolist()))
+    else:
+        # umbrella weights depend on the vertex positions
+        key = ('laplacian_umbrella', tuple(pinned.tolist()))
+    cached = mesh._cache[key]
+    if cached is not None:
+        # copy so callers can't edit the cached operator
+        return cached.copy()
+
     # get the vertex neighbors from the cache
     neighbors = mesh.vertex_neighbors
 
-    # if a node is pinned, it will average his coordinates by himself
-    # in practice it will not move
-    for i in pinned_vertices:
-        neighbors[i] = [i]
-
     # avoid hitting crc checks in loops
     vertices = mesh.vertices.view(np.ndarray)
 
     # stack neighbors to 1D arrays
     col = np.concatenate(neighbors)
-    row = np.concatenate([[i] * len(n)
-                          for i, n in enumerate(neighbors)])
+    # number of neighbors for each vertex, as intp since
+    # np.repeat refuses to cast int64 counts on 32-bit platforms
+    counts = np.fromiter((len(n) for n in neighbors),
+                         dtype=np.intp,
+                         count=len(neighbors))
+    # the vertex index repeated once for each of its neighbors
+    row = np.repeat(np.arange(len(neighbors), dtype=np.intp), counts)
 
     if equal_weight:
-        # equal weights for each neighbor
-        data = np.concatenate([[1.0 / len(n)] * len(n)
-                               for n in neighbors])
+        # equal weights for each neighbor, isolated vertices
+        # are repeated zero times so only avoid dividing by zero
+        data = np.repeat(1.0 / np.maximum(counts, 1), counts)
     else:
         # umbrella weights, distance-weighted
+        diffs = vertices[row] - vertices[col]
         # use dot product of ones to replace array.sum(axis=1)
-        ones = np.ones(3)
-        # the distance from verticesex to neighbors
-        norms = [
-            1.0 / np.maximum(1e-6, np.sqrt(np.dot(
-                (vertices[i] - vertices[n]) ** 2, ones)))
-            for i, n in enumerate(neighbors)]
-        # normalize group and stack into single array
-        data = np.concatenate([i / i.sum() for i in norms])
+        norms = 1.0 / np.maximum(1e-6, np.sqrt(
+            np.dot(diffs ** 2, np.ones(3))))
+        # normalize each group of neighbors by its sum
+        data = norms / np.bincount(
+            row, weights=norms, minlength=len(neighbors))[row]
+
+    if len(pinned) > 0:
+        # if a node is pinned, it will average his coordinates by himself
+        # in practice it will not move
+        # replace its row here rather than editing the cached neighbors
+        keep = ~np.in1d(row, pinned)
+        row = np.concatenate((row[keep], pinned))
+        col = np.concatenate((col[keep], pinned))
+        data = np.concatenate((data[keep], np.ones(len(pinned))))
 
     # create the sparse matrix
     matrix = coo_matrix((data, (row, col)),
-                        shape=[len(vertices)] * 2)
+                        shape=[len(vertices)] * 2).tocsr()
+    # store the operator until the mesh changes
+    mesh._cache[key] = matrix
 
-    return matrix
+    return matrix.copy()
 
 
-def get_vertices_normals(mesh):
+def get_vertices_normals(mesh,
+                         incidence_csr=None,
+                         vertices=None,
+                         faces=None):
     """
     Compute Vertex normals using equal weighting of neighbors faces.
     Parameters
       -------------
       mesh : trimesh.Trimesh
         Input geometry
+      incidence_csr : None or scipy.sparse.csr_matrix
+        Vertex to face incidence from `index_sparse` in CSR
+        form, pass to reuse it while the faces do not change
+        Will be autogenerated if None
+      vertices : None or (n, 3) float
+        Vertex positions to use instead of the mesh vertices
+        while smoothing, before they are assigned back
+      faces : None or (m, 3) int
+        Faces referencing vertices, mesh faces if None
       Returns
       ----------
       vertices_normals: array
         Vertices normals
     """
 
-    # get mesh vertices and faces
-    vertices = mesh.vertices
-    faces = mesh.faces
+    # get mesh faces
+    if faces is None:
+        faces = mesh.faces
 
     # get face normals
-    face_normals = mesh.face_normals
+    if vertices is None:
+        vertices = mesh.vertices
+        face_normals = mesh.face_normals
+    else:
+        # normals of the passed positions rather than the mesh
+        origin = vertices[faces[:, 0]]
+        face_normals = unitize(np.cross(vertices[faces[:, 1]] - origin,
+                                        vertices[faces[:, 2]] - origin))
 
     # Compute Vert normals
-    vert_normals = index_sparse(len(vertices), faces).dot(face_normals)
+    if incidence_csr is None:
+        incidence_csr = index_sparse(len(vertices), faces)
+    vert_normals = incidence_csr.dot(face_normals)
 
     return unitize(vert_normals)
 
 
-def dilate_slope(vertices, faces, normals, v, eps):
+def dilate_slope(vertices, faces, normals, v=None, eps=None):
     """
-    Get de derivate of dilation scalar by the volume variation by finite diferences
+    Get de derivate of dilation scalar by the volume variation
     Thus, Vertices += vertex_normals*dilate_slope*(Initial_Volume - Srinked_Volume)
+    Moving every vertex a distance t along its normal changes the
+    volume by t * sum(face_area * face_normal . mean_vertex_normal)
+    to first order, so the derivative is found in closed form
     Parameters
       -------------
-      mesh : trimesh.Trimesh
-        Input geometry
       vertices: mesh.vertices
       faces: mesh.faces
       normals: array
         vertices normals
+      v : None
+        Unused, kept for compatibility
+      eps : None
+        Unused, kept for compatibility
       Returns
       ----------
       dilate_slope: float
         derivative
     """
+    # the cross product of each face is double its area
+    # times its normal
+    origin = vertices[faces[:, 0]]
+    crosses = np.cross(vertices[faces[:, 1]] - origin,
+                       vertices[faces[:, 2]] - origin)
+    # sum of the vertex normals of each face
+    normals_face = (normals[faces[:, 0]] +
+                    normals[faces[:, 1]] +
+                    normals[faces[:, 2]])
+    # rate of volume change by distance moved along normals
+    rate = np.einsum('ij,ij->i', crosses, normals_face).sum() / 6.0
+
+    return 1.0 / rate
+
+
+@contextmanager
+def _split_rows(threads, operator):
+    """
+    Open worker threads for one filter call and yield a function
+    which splits CSR operators into blocks of rows whose sparse
+    dot products run on those threads.
 
-    # finite diference derivative
-    vertices2 = vertices + normals * eps
-    v2 = mass_properties(vertices2[faces], skip_inertia=True)["volume"]
+    The threads are closed once the call is done: a pool kept
+    between calls would hang any process forked from this one.
 
-    return (eps) / (v2 - v)
+    Parameters
+    -------------
+    threads : None or int
+      Number of threads, if None run serially
+      Operators smaller than `_threads_min_nnz` nonzeros
+      or `_threads_min_rows` rows always run serially
+    operator : scipy.sparse.csr_matrix
+      Sparse matrix laplacian operator
+
+    Yields
+    ----------
+    split : function
+      Takes a CSR operator and returns an object with a `dot`
+      method, the operator itself if running serially
+    """
+    if (threads is None or
+            operator.nnz < _threads_min_nnz or
+            operator.shape[0] < _threads_min_rows):
+        threads = 1
+    threads = min(int(threads), operator.shape[0])
+    if threads <= 1:
+        yield lambda split: split
+        return
+
+    pool = ThreadPool(threads)
+    try:
+        yield lambda split: _RowBlocks(split, pool, threads)
+    finally:
+        pool.close()
+        pool.join()
+
+
+class _RowBlocks(object):
+    """
+    A CSR operator split into contiguous blocks of rows.
+
+    SciPy releases the GIL inside its sparse dot products, so
+    each block can be multiplied on its own thread and write
+    its own rows of the result.
+    """
+
+    def __init__(self, operator, pool, threads):
+        bounds = np.linspace(
+            0, operator.shape[0], threads + 1).astype(np.int64)
+        self.slices = [slice(a, b) for a, b in
+                       zip(bounds[:-1], bounds[1:])]
+        self.blocks = [operator[s] for s in self.slices]
+        self.shape = operator.shape
+        self.dtype = operator.dtype
+        self.pool = pool
+
+    def dot(self, other):
+        """
+        Multiply the operator by a dense array.
+
+        Parameters
+        -------------
+        other : (n, d) float
+          Dense array to multiply
+
+        Returns
+        ----------
+        result : (n, d) float
+          Product of the operator and other
+        """
+        result = np.empty((self.shape[0],) + other.shape[1:],
+                          dtype=np.result_type(self.dtype, other.dtype))
+
+        def block_dot(index):
+            # each block writes only its own rows of the result
+            result[self.slices[index]] = self.blocks[index].dot(other)
+
+        self.pool.map(block_dot, range(len(self.blocks)))
+        return result
+
+
+def _prepare(mesh, laplacian_operator, reorder, dtype):
+    """
+    Get the operator, vertices and faces a filter smooths with.
+
+    Parameters
+    -------------
+    mesh : trimesh.Trimesh
+      Mesh to be smoothed
+    laplacian_operator : None or scipy.sparse.csr_matrix
+      Sparse matrix laplacian operator
+      Will be autogenerated if None
+    reorder : bool
+      If True renumber vertices with reverse Cuthill-McKee
+    dtype : None or numpy.dtype
+      Precision to smooth in
+
+    Returns
+    ----------
+    laplacian_operator : scipy.sparse.csr_matrix
+      Operator in the precision and order of vertices
+    vertices : (n, 3) float
+      C-contiguous copy of the mesh vertices
+    faces : (m, 3) int
+      Mesh faces referencing vertices
+    inverse : None or (n,) int
+      Reordered index of each original vertex
+    """
+    # if the laplacian operator was not passed create it here
+    if laplacian_operator is None:
+        laplacian_operator = laplacian_calculation(mesh)
+    # sparse dot products are run in CSR so convert only once
+    laplacian_operator = laplacian_operator.tocsr()
+
+    # get mesh vertices and faces as vanilla numpy array
+    # vertices are C-contiguous so each sparse dot walks the
+    # operator once for all three columns without a copy
+    vertices = np.array(mesh.vertices, dtype=dtype, order='C')
+    # run the sparse dot products in the same precision
+    laplacian_operator = laplacian_operator.astype(
+        vertices.dtype, copy=False)
+    # faces are never modified so a view is enough
+    faces = np.asarray(mesh.faces)
+
+    inverse = None
+    if reorder:
+        laplacian_operator, order, inverse = _reorder(laplacian_operator)
+        vertices = vertices[order]
+        faces = inverse[faces]
+
+    return laplacian_operator, vertices, faces, inverse
+
+
+def _assign(mesh, vertices, inverse):
+    """
+    Assign smoothed vertices back to a mesh.
+
+    Parameters
+    -------------
+    mesh : trimesh.Trimesh
+      Mesh being smoothed
+    vertices : (n, 3) float
+      Smoothed vertex positions
+    inverse : None or (n,) int
+      Reordered index of each original vertex
+    """
+    # undo the reordering from _prepare
+    if inverse is not None:
+        vertices = vertices[inverse]
+
+    # dump anything stale before choosing what to keep
+    mesh._cache.verify()
+    # only the vertices move so the equal weight operators
+    # from laplacian_calculation are still valid
+    keep = [key for key in mesh._cache.cache
+            if isinstance(key, tuple) and key[0] == 'laplacian']
+    # avoid clearing the cache while assigning
+    with mesh._cache:
+        mesh.vertices = vertices
+    mesh._cache.clear(exclude=keep)
+
+
+def _reorder(laplacian_operator):
+    """
+    Find a reverse Cuthill-McKee ordering of the vertices which
+    reduces the bandwidth of the laplacian, so the rows read by
+    each sparse dot product are close together in memory.
+
+    Parameters
+    -------------
+    laplacian_operator : scipy.sparse.csr_matrix
+      Sparse matrix laplacian operator
+
+    Returns
+    ----------
+    reordered : scipy.sparse.csr_matrix
+      Laplacian operator with rows and columns permuted
+    order : (n,) int
+      Original index of each reordered vertex
+    inverse : (n,) int
+      Reordered index of each original vertex
+    """
+    # vertex neighbors are symmetric apart from pinned rows
+    # which only means the ordering may be slightly worse
+    order = reverse_cuthill_mckee(
+        laplacian_operator, symmetric_mode=True)
+    inverse = np.empty_like(order)
+    inverse[order] = np.arange(len(order))
+    # remap the indexes rather than slicing twice
+    coo = laplacian_operator.tocoo()
+    reordered = coo_matrix(
+        (coo.data, (inverse[coo.row], inverse[coo.col])),
+        shape=laplacian_operator.shape).tocsr()
+    return reordered, order, inverse
+
+
+def _mesh_volume(vertices, faces):
+    """
+    Find the volume of a closed mesh as the sum of the signed
+    volumes of the tetrahedra between each face and the origin.
+
+    Parameters
+    -------------
+    vertices : (n, 3) float
+      Vertex positions
+    faces : (m, 3) int
+      Triangles referencing vertices
+
+    Returns
+    ----------
+    volume : float
+      Signed volume of the mesh
+    """
+    # always find the volume in float64 so smoothing in
+    # reduced precision does not drift the volume constraint
+    vertices = np.asarray(vertices, dtype=np.float64)
+    # triple product of each face without an (m, 3, 3) gather
+    triple = np.einsum('ij,ij->i',
+                       vertices[faces[:, 0]],
+                       np.cross(vertices[faces[:, 1]],
+                                vertices[faces[:, 2]]))
+    return triple.sum() / 6.0